@@ -0,0 +1,110 @@
+"""
+----------------------------------------------------------------------------
+
+This file is part of the Sanworks ArCOM repository
+Copyright (C) 2018 Sanworks LLC, Sound Beach, New York, USA
+
+----------------------------------------------------------------------------
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, version 3.
+
+This program is distributed  WITHOUT ANY WARRANTY and without even the
+implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# ArCom simplifies serial communication of different data types between
+# Python and Arduino, matching the byte-level framing used by the ArCOM
+# Arduino library (see Arduino/Frame2TTL/ArCOM.h) and by the MATLAB
+# ArCOMObject_Frame2TTL class.
+#
+# Initialization:
+# my_port = ArCom('COM3', 115200)
+# where 'COM3' is the name of the device's serial port on your system.
+#
+# Write: my_port.write(my_data, 'uint8')
+# where 'uint8' is a data type from: 'uint8', 'uint16', 'uint32',
+# 'int8', 'int16', 'int32', 'char'. Additional (data, datatype) pairs can
+# be appended, to be packaged into a single write operation:
+# my_port.write(data1, type1, data2, type2, ... dataN, typeN)
+#
+# Read: my_data = my_port.read(n_values, 'uint8')
+# where n_values is the number of values to read.
+#
+# End: my_port.close()
+
+import numpy as np
+import serial
+
+# Cached dtype objects, so read/write do a dict lookup per call instead of
+# constructing a np.dtype from its string name
+_DTYPES = {'uint8': np.dtype('<u1'), 'int8': np.dtype('<i1'),
+           'uint16': np.dtype('<u2'), 'int16': np.dtype('<i2'),
+           'uint32': np.dtype('<u4'), 'int32': np.dtype('<i4')}
+
+
+class ArCom(object):
+    def __init__(self, port_name, baud_rate):
+        """Open a serial connection to the device on port_name."""
+        self.serialObject = serial.Serial(port_name, baud_rate, timeout=1)
+
+    def bytes_available(self):
+        """Return the number of bytes waiting in the serial input buffer."""
+        return self.serialObject.in_waiting
+
+    def write_raw(self, message_bytes):
+        """Write a pre-encoded bytes message directly, bypassing dtype dispatch."""
+        self.serialObject.write(message_bytes)
+
+    def write(self, *args):
+        """Write alternating (data, datatype) argument pairs as a single serial transmission."""
+        n_types = int(len(args) / 2)
+        message_bytes = b''
+        arg_pos = 0
+        for i in range(n_types):
+            data = args[arg_pos]
+            datatype = args[arg_pos + 1]
+            arg_pos += 2
+            if datatype == 'char':
+                message_bytes += str(data).encode('utf-8')
+            else:
+                message_bytes += np.array(data, dtype=_DTYPES[datatype]).tobytes()
+        self.serialObject.write(message_bytes)
+
+    def read(self, n_values, datatype='uint8'):
+        """Read n_values of datatype from the serial port. Returns a numpy array."""
+        dtype = _DTYPES[datatype]
+        n_bytes = n_values * dtype.itemsize
+        message_bytes = self.serialObject.read(n_bytes)
+        if len(message_bytes) < n_bytes:
+            raise ArComError('Error: serial port timed out. ' + str(len(message_bytes)) +
+                             ' of ' + str(n_bytes) + ' expected bytes were returned.')
+        return np.frombuffer(message_bytes, dtype=dtype)
+
+    def read_u32(self, n_values):
+        """Typed fast path for the hot read paths: n_values little-endian uint32."""
+        n_bytes = n_values * 4
+        message_bytes = self.serialObject.read(n_bytes)
+        if len(message_bytes) < n_bytes:
+            raise ArComError('Error: serial port timed out. ' + str(len(message_bytes)) +
+                             ' of ' + str(n_bytes) + ' expected bytes were returned.')
+        return np.frombuffer(message_bytes, dtype=_DTYPES['uint32'])
+
+    def close(self):
+        """Close and release the serial port."""
+        self.serialObject.close()
+
+    def __del__(self):
+        try:
+            self.serialObject.close()
+        except Exception:
+            pass
+
+
+class ArComError(Exception):
+    pass
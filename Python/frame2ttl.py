@@ -0,0 +1,488 @@
+"""
+----------------------------------------------------------------------------
+
+This file is part of the Sanworks Frame2TTL repository
+Copyright (C) 2018 Sanworks LLC, Sound Beach, New York, USA
+
+----------------------------------------------------------------------------
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, version 3.
+
+This program is distributed  WITHOUT ANY WARRANTY and without even the
+implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Frame2TTL is a system to measure the instant when a computer monitor updates its display.
+# It uses a light sensor that outputs light intensity as a square wave. The
+# period of the square wave ("Sensor Value" in microseconds) encodes light intensity.
+# Lower periods = higher frequency = higher light intensity. A typical
+# value for a patch of screen whose pixels are at max intensity = 20us. A
+# typical value for a patch of screen at minimum intensity = 500us. A
+# typical value in total darkness = 20,000us.
+#
+# Usage:
+# - Create a Frame2TTL object with F = Frame2TTL('COM3') where COM3 is your serial port
+# - Set F.light_threshold and F.dark_threshold to change threshold parameters on the device
+# - Call F.read_sensor_value() to return the current sensor value
+# - Call F.measure_light() to return summary statistics of the sensor signal
+# - Call F.stream_ui() to view the streaming sensor signal (for testing purposes)
+# - Call F.close() when finished, or use the object as a context manager:
+#   with Frame2TTL('COM3') as F: ...
+
+import collections
+import math
+import os
+import struct
+from numbers import Integral
+
+import numpy as np
+import pyqtgraph as pg
+from PyQt5 import QtCore, QtWidgets
+
+from arcom import ArCom
+
+# Plot defaults for every stream_ui widget: antialiasing off (the dominant
+# paint cost for a dense polyline, invisible at the pen widths used here)
+# and the white-background/black-foreground scheme of the MATLAB scope
+pg.setConfigOptions(antialias=False, background='w', foreground='k')
+
+_CMD_HANDSHAKE = ord('C')  # Confirm USB connection
+_CMD_SET_THRESHOLDS = ord('T')  # Set light/dark thresholds
+_CMD_READ_VALUE = ord('V')  # Return last sensor value
+_CMD_STREAM = ord('S')  # Start/stop streaming sensor values
+_STREAM_ON = bytes((_CMD_STREAM, 1))  # Pre-encoded stream start/stop packets
+_STREAM_OFF = bytes((_CMD_STREAM, 0))
+_HANDSHAKE_MSG = bytes((_CMD_HANDSHAKE,))  # Pre-encoded single-byte commands
+_READ_VALUE_MSG = bytes((_CMD_READ_VALUE,))
+_STAT_KEYS = ('mean_value', 'max_value', 'min_value', 'std_value', 'sem_value')
+HANDSHAKE_REPLY = 218
+SAMPLE_RATE = 100  # Sensor values arrive at 100Hz while streaming (set in firmware)
+SAMPLE_PERIOD_S = 1.0 / SAMPLE_RATE
+DISPLAY_SAMPLES = 2000  # Number of samples shown in the stream_ui plot window
+
+
+class Frame2TTL(object):
+    _qt_app = None  # Shared QApplication, reused across stream_ui() calls
+
+    def __init__(self, port_name):
+        """Connect to the Frame2TTL device on port_name and set default thresholds."""
+        self.port = ArCom(port_name, 115200)
+        serial_object = self.port.serialObject
+        original_timeout = serial_object.timeout
+        serial_object.timeout = 0.25  # The device replies immediately; fail fast if it is absent
+        self.port.write_raw(_HANDSHAKE_MSG)
+        response = serial_object.read(1)
+        serial_object.timeout = original_timeout
+        if len(response) == 0 or response[0] != HANDSHAKE_REPLY:
+            raise Frame2TTLError('Error: could not connect to Frame2TTL on port ' + port_name)
+        self._light_threshold = 40
+        self._dark_threshold = 80
+        # Force the device write: it may retain other thresholds from a
+        # previous host session
+        self._set_light_threshold(40)
+        self._set_dark_threshold(80)
+        self._rx_scratch = np.empty(65536, dtype=np.uint32)  # Reusable read_sensor buffer
+
+    @property
+    def light_threshold(self):
+        """Sensor value (us) below which the device reports a dark -> light frame transition."""
+        return self._light_threshold
+
+    @light_threshold.setter
+    def light_threshold(self, value):
+        if not isinstance(value, Integral) or value <= 0:
+            raise Frame2TTLError('Error: light_threshold must be a positive integer.')
+        value = int(value)  # Normalize numpy integers once, before packing
+        if value == self._light_threshold:
+            return  # No-op assignment: skip the serial round trip
+        self._set_light_threshold(value)
+
+    def _set_light_threshold(self, value):
+        # Fast path: writes the threshold packet with no validation. Internal
+        # callers pass known-good ints; the public setter validates once.
+        self.port.write_raw(struct.pack('<BHH', _CMD_SET_THRESHOLDS, value, self._dark_threshold))
+        self._light_threshold = value
+
+    @property
+    def dark_threshold(self):
+        """Sensor value (us) above which the device reports a light -> dark frame transition."""
+        return self._dark_threshold
+
+    @dark_threshold.setter
+    def dark_threshold(self, value):
+        if not isinstance(value, Integral) or value <= 0:
+            raise Frame2TTLError('Error: dark_threshold must be a positive integer.')
+        value = int(value)  # Normalize numpy integers once, before packing
+        if value == self._dark_threshold:
+            return  # No-op assignment: skip the serial round trip
+        self._set_dark_threshold(value)
+
+    def _set_dark_threshold(self, value):
+        # Fast path counterpart of _set_light_threshold (no validation)
+        self.port.write_raw(struct.pack('<BHH', _CMD_SET_THRESHOLDS, self._light_threshold, value))
+        self._dark_threshold = value
+
+    def read_sensor_value(self):
+        """Return the current sensor value (us between light level transitions)."""
+        self.port.write_raw(_READ_VALUE_MSG)
+        return int(self.port.read_u32(1)[0])
+
+    def read_sensor(self, n_samples=1, out=None):
+        """Return n_samples streamed sensor values (us) as a numpy array.
+
+        Samples arrive at SAMPLE_RATE Hz, so n_samples determines the
+        measurement duration. Pass a preallocated uint32 array as out to
+        reuse a buffer across calls (it is filled and returned with no
+        copy); otherwise a copy the caller owns is returned.
+        """
+        if out is not None:
+            if len(out) != n_samples:
+                raise Frame2TTLError('Error: out must hold exactly n_samples values.')
+            return self.read_sensor_into(out)
+        if n_samples > len(self._rx_scratch):
+            return self.read_sensor_into(np.empty(n_samples, dtype=np.uint32))
+        return self.read_sensor_into(self._rx_scratch[:n_samples]).copy()
+
+    def read_sensor_into(self, out):
+        """Fill the uint32 array out with streamed sensor values and return it.
+
+        Reads directly into the caller's buffer, avoiding a bytes allocation
+        and copy per call. Returns out (not a copy).
+        """
+        self.port.write_raw(_STREAM_ON)
+        view = memoryview(out).cast('B')
+        n_bytes = len(view)
+        n_read = 0
+        while n_read < n_bytes:
+            n = self.port.serialObject.readinto(view[n_read:])
+            if n == 0:
+                raise Frame2TTLError('Error: serial port timed out while streaming sensor values.')
+            n_read += n
+        self.port.write_raw(_STREAM_OFF)
+        self.port.serialObject.reset_input_buffer()  # Discard samples sent before stream-stop took effect
+        return out
+
+    def read_sensor_stream(self, n_samples, chunk_size=1024):
+        """Yield n_samples streamed sensor values (us) one at a time.
+
+        Polling loops should use this instead of calling read_sensor_value()
+        repeatedly: one stream request replaces a USB round trip per sample,
+        and values are read in batches of up to chunk_size as they arrive.
+        """
+        serial_object = self.port.serialObject
+        self.port.write_raw(_STREAM_ON)
+        try:
+            remaining = n_samples
+            while remaining > 0:
+                # Read at least one value (blocking), draining any backlog in
+                # bulk with a single fixed-size read
+                n_to_read = max(1, min(remaining, serial_object.in_waiting // 4, chunk_size))
+                raw = serial_object.read(n_to_read * 4)
+                if len(raw) < n_to_read * 4:
+                    raise Frame2TTLError('Error: serial port timed out while streaming sensor values.')
+                yield from np.frombuffer(raw, dtype=np.uint32)
+                remaining -= n_to_read
+        finally:
+            self.port.write_raw(_STREAM_OFF)
+            serial_object.reset_input_buffer()
+
+    def stream_to_file(self, path, duration_s):
+        """Stream sensor values straight to a binary file.
+
+        Captures duration_s seconds of streamed values and writes them to
+        path as raw little-endian uint32 (us), looping serial reads through
+        a fixed 64KB buffer and raw os writes. Memory use is constant
+        regardless of capture length; load the result with
+        np.fromfile(path, dtype=np.uint32). Returns the number of samples
+        written.
+        """
+        n_bytes_total = int(duration_s * SAMPLE_RATE) * 4
+        buf = bytearray(65536)
+        view = memoryview(buf)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0))
+        serial_object = self.port.serialObject
+        self.port.write_raw(_STREAM_ON)
+        try:
+            n_written = 0
+            while n_written < n_bytes_total:
+                n = serial_object.readinto(view[:min(len(buf), n_bytes_total - n_written)])
+                if n == 0:
+                    raise Frame2TTLError('Error: serial port timed out while streaming sensor values.')
+                os.write(fd, view[:n])
+                n_written += n
+        finally:
+            self.port.write_raw(_STREAM_OFF)
+            serial_object.reset_input_buffer()
+            os.close(fd)
+        return n_written // 4
+
+    def measure_light(self, n_samples=250):
+        """Measure the sensor signal and return summary statistics.
+
+        Reads n_samples values (2.5s at the default n_samples) and returns a
+        dict of mean, max, min, std and sem of the sensor values in us.
+        """
+        sensor_data = self.read_sensor_into(self._rx_scratch[:n_samples])
+        mean_value, max_value, min_value, std_value = self._sensor_stats(sensor_data)
+        # One bulk tolist() conversion to Python floats instead of a float()
+        # call per field; num_samples stays an int
+        values = np.array([mean_value, max_value, min_value, std_value,
+                           std_value / math.sqrt(n_samples)]).tolist()
+        stats = dict(zip(_STAT_KEYS, values))
+        stats['num_samples'] = n_samples
+        return stats
+
+    @staticmethod
+    def _sensor_stats(sensor_data):
+        """Return (mean, max, min, std) of sensor_data with consolidated reductions.
+
+        The mean and std both derive from one sum and one self-dot-product
+        (var = E[x^2] - E[x]^2), so the moments cost two vectorized passes
+        instead of the four numpy's separate mean/std kernels would make.
+        Integer input is cast to float32 once and reused by every reduction,
+        rather than letting each reduction upcast to a float64 temporary;
+        float32 represents sensor values (us) exactly up to 2^24.
+        """
+        values = sensor_data.astype(np.float32, copy=False)
+        n = values.size
+        total = float(values.sum())
+        sum_squares = values.dot(values)
+        mean = total / n
+        variance = sum_squares / n - mean * mean
+        return mean, values.max(), values.min(), math.sqrt(max(variance, 0.0))
+
+    def set_light_threshold_auto(self, duration_s=2.5):
+        """Measure the sensor and set light_threshold from the measurement.
+
+        Run this with the sync patch of screen at maximum intensity. The
+        threshold is set to twice the 99th percentile of the measured values,
+        leaving margin above the bright-screen signal (typically ~20us ->
+        threshold ~40) while ignoring isolated glitch samples. Sampling takes
+        duration_s seconds; the serial reads block until the samples arrive,
+        so no fixed wall-clock wait is used. Returns the new threshold.
+        """
+        n_samples = int(duration_s * SAMPLE_RATE)
+        sensor_data = self.read_sensor_into(self._rx_scratch[:n_samples])
+        self._set_light_threshold(int(np.percentile(sensor_data, 99)) * 2)
+        return self._light_threshold
+
+    def set_dark_threshold_auto(self, duration_s=2.5):
+        """Measure the sensor and set dark_threshold from the measurement.
+
+        Run this with the sync patch of screen at minimum intensity. The
+        threshold is set to one sixth of the 1st percentile of the measured
+        values, leaving margin below the dark-screen signal (typically ~500us
+        -> threshold ~83) while ignoring isolated glitch samples. Sampling
+        takes duration_s seconds; the serial reads block until the samples
+        arrive, so no fixed wall-clock wait is used. Returns the new threshold.
+        """
+        n_samples = int(duration_s * SAMPLE_RATE)
+        sensor_data = self.read_sensor_into(self._rx_scratch[:n_samples])
+        self._set_dark_threshold(int(np.percentile(sensor_data, 1)) // 6)
+        return self._dark_threshold
+
+    @staticmethod
+    def detect_transitions(sensor_data, light_threshold, dark_threshold):
+        """Replay the device's TTL output logic over recorded sensor values.
+
+        sensor_data is an array of sensor values (us), e.g. from read_sensor().
+        Returns (indices, directions): sample indices at which the TTL output
+        would change state, and +1 for each dark -> light transition, -1 for
+        each light -> dark transition. Useful for validating threshold choices
+        offline without re-measuring.
+        """
+        sensor_data = np.asarray(sensor_data)
+        below = sensor_data < light_threshold
+        above = sensor_data > dark_threshold
+        # Only samples beyond a threshold can change the output state, so the
+        # sequential hysteresis scan visits candidate indices, not all samples
+        candidates = np.flatnonzero(below | above)
+        indices = []
+        directions = []
+        in_pulse = False
+        for i in candidates:
+            if not in_pulse and below[i]:
+                indices.append(i)
+                directions.append(1)
+                in_pulse = True
+            elif in_pulse and above[i]:
+                indices.append(i)
+                directions.append(-1)
+                in_pulse = False
+        return np.array(indices, dtype=np.intp), np.array(directions, dtype=np.int8)
+
+    @staticmethod
+    def windowed_mean(sensor_data, window=20):
+        """Return the sliding-window mean of recorded sensor values.
+
+        Builds an O(1) strided view over sensor_data and reduces it with a
+        single vectorized mean, instead of averaging each window in a Python
+        loop. The result has len(sensor_data) - window + 1 values.
+        """
+        windows = np.lib.stride_tricks.sliding_window_view(np.asarray(sensor_data), window)
+        return windows.mean(axis=-1)
+
+    def stream_ui(self):
+        """Launch a live plot of the streaming sensor signal (for testing purposes)."""
+        if Frame2TTL._qt_app is None:
+            Frame2TTL._qt_app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+        main_window = MainWindow(self)
+        main_window.show()
+        Frame2TTL._qt_app.exec_()
+
+    def close(self):
+        """Stop streaming and release the serial port."""
+        try:
+            self.port.write_raw(_STREAM_OFF)
+        except Exception:
+            pass  # Port may already be closed
+        self.port.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class SensorReaderThread(QtCore.QThread):
+    """Background thread that blocks on serial reads and emits sample chunks.
+
+    Decouples USB ingestion from the GUI frame rate: the thread sleeps inside
+    the OS read call and hands full chunks to the GUI via a queued signal, so
+    no samples are dropped during GUI stalls and no polling gap is added.
+    A small pool of rotating buffers lets the thread fill one while the GUI
+    consumes earlier chunks without an allocation per chunk; the pool depth
+    bounds how far the GUI may lag before a buffer is recycled.
+    """
+    samples_ready = QtCore.pyqtSignal(np.ndarray)
+
+    def __init__(self, port, chunk_samples=512, pool_depth=4, parent=None):
+        super(SensorReaderThread, self).__init__(parent)
+        self.port = port
+        self._buffers = collections.deque(
+            (np.empty(chunk_samples, dtype=np.uint32) for _ in range(pool_depth)),
+            maxlen=pool_depth)
+        self._stop = False
+
+    def run(self):
+        serial_object = self.port.serialObject
+        while not self._stop:
+            buf = self._buffers[0]
+            view = memoryview(buf).cast('B')
+            # Block until one full sample has arrived (readinto honors the
+            # port timeout, so a stop request is noticed within ~1s)
+            n_read = 0
+            while n_read < 4 and not self._stop:
+                n_read += serial_object.readinto(view[n_read:4])
+            if self._stop:
+                break
+            # Drain whatever else is already waiting, up to the chunk size
+            n_samples = 1 + min(serial_object.in_waiting // 4, len(buf) - 1)
+            if n_samples > 1:
+                serial_object.readinto(view[4:n_samples * 4])
+            self.samples_ready.emit(buf[:n_samples])
+            self._buffers.rotate(-1)
+
+    def stop(self):
+        self._stop = True
+
+
+class MainWindow(QtWidgets.QMainWindow):
+    def __init__(self, frame2ttl):
+        super(MainWindow, self).__init__()
+        self.port = frame2ttl.port
+        self.setWindowTitle('Frame2TTL Sensor Stream')
+        self.plot_widget = pg.PlotWidget()
+        self.setCentralWidget(self.plot_widget)
+        self.plot_widget.setYRange(0, 500)
+        self.plot_widget.setLabel('left', 'Sensor value (us)')
+        self.plot_widget.setLabel('bottom', 'Time (s)')
+        self.x = np.arange(DISPLAY_SAMPLES, dtype=np.float32) * SAMPLE_PERIOD_S
+        # Two mirrored copies of the display ring: each sample is written at
+        # i and i + DISPLAY_SAMPLES, so y[ypos:ypos + DISPLAY_SAMPLES] is
+        # always a contiguous oldest-to-newest view and rendering needs no
+        # per-frame concatenation
+        self.y = np.zeros(DISPLAY_SAMPLES * 2, dtype=np.float32)
+        self.ypos = 0  # Ring buffer write position
+        self._dirty = False  # True when samples arrived since the last redraw
+        # The y-range is fixed and the ring never holds non-finite values, so
+        # per-frame bounds recomputation and finite checks are disabled;
+        # peak-preserving downsampling keeps redraw cost flat as the window grows
+        self.plot_widget.setMouseEnabled(x=False, y=False)
+        self.plot_widget.disableAutoRange()
+        my_pen = pg.mkPen(color=(0, 0, 0), width=3)
+        self.data_line = self.plot_widget.plot(
+            self.x, self.y[:DISPLAY_SAMPLES], pen=my_pen, autoDownsample=True,
+            clipToView=True, downsampleMethod='peak', skipFiniteCheck=True)
+        # Overlay the current thresholds so their position relative to the
+        # signal can be judged directly from the stream (as in the MATLAB UI)
+        self.light_threshold_line = pg.InfiniteLine(
+            pos=frame2ttl.light_threshold, angle=0, pen=pg.mkPen(color=(153, 153, 153)))
+        self.dark_threshold_line = pg.InfiniteLine(
+            pos=frame2ttl.dark_threshold, angle=0, pen=pg.mkPen(color=(77, 77, 77)))
+        self.plot_widget.addItem(self.light_threshold_line)
+        self.plot_widget.addItem(self.dark_threshold_line)
+        self.port.write_raw(_STREAM_ON)
+        self.reader = SensorReaderThread(self.port)
+        self.reader.samples_ready.connect(self.update_plot_data)
+        self.reader.start()
+        self.timer = QtCore.QTimer()
+        # PreciseTimer keeps the render cadence from being coalesced to the
+        # OS's coarse (~15.6ms on Windows) timer resolution
+        self.timer.setTimerType(QtCore.Qt.PreciseTimer)
+        self.timer.setInterval(16)
+        self.timer.timeout.connect(self.render_plot)
+        self.timer.start()
+
+    def update_plot_data(self, new_samples):
+        n_samples = len(new_samples)
+        if n_samples >= DISPLAY_SAMPLES:
+            newest = new_samples[-DISPLAY_SAMPLES:]
+            self.y[:DISPLAY_SAMPLES] = newest
+            self.y[DISPLAY_SAMPLES:] = newest
+            self.ypos = 0
+        else:
+            end = (self.ypos + n_samples) % DISPLAY_SAMPLES
+            if end < self.ypos:  # Wraparound: split the write across the ring edge
+                n_first = DISPLAY_SAMPLES - self.ypos
+                self.y[self.ypos:DISPLAY_SAMPLES] = new_samples[:n_first]
+                self.y[:end] = new_samples[n_first:]
+                self.y[DISPLAY_SAMPLES + self.ypos:] = new_samples[:n_first]
+                self.y[DISPLAY_SAMPLES:DISPLAY_SAMPLES + end] = new_samples[n_first:]
+            else:
+                self.y[self.ypos:end] = new_samples
+                self.y[DISPLAY_SAMPLES + self.ypos:DISPLAY_SAMPLES + end] = new_samples
+            self.ypos = end
+        self._dirty = True
+
+    def render_plot(self):
+        if self._dirty:
+            # The mirrored ring makes this a contiguous view with the newest
+            # sample at the right edge
+            self.data_line.setData(self.x, self.y[self.ypos:self.ypos + DISPLAY_SAMPLES])
+            self._dirty = False
+
+    def closeEvent(self, event):
+        self.timer.stop()
+        self.reader.stop()
+        self.port.write_raw(_STREAM_OFF)
+        self.reader.wait()
+        self.port.serialObject.reset_input_buffer()
+        event.accept()
+
+
+class Frame2TTLError(Exception):
+    pass